@@ -1,12 +1,21 @@
 import torch, random, numpy as np
 from game_ai_playable import *
 from collections import deque
+from contextlib import nullcontext
 from model import Linear_QNet, QTrainer
-from helper import plot
+from learner import AsyncLearner, LEARNER_THREADS, ACTOR_THREADS
+from helper import plot, figure_count
 
 MAX_MEMORY = 100_000        # store maximum 100,000 games
 BATCH_SIZE = 1000           # batch size for training
 LR = 0.001                  # learning rate
+N_STEP = 1                  # transitions summed into each stored return
+TARGET_UPDATE = 0           # hard sync target net every n long memory batches (0 = no target net)
+TAU = None                  # polyak factor for soft target sync after each long memory batch, overrides TARGET_UPDATE
+LONG_TRAIN_STEPS = 1        # gradient steps on long memory after each game
+MAX_EPSILON = 180           # games until exploration stops, out of 200
+RANDOM_JUMP_PROB = 0.05     # chance a random move is a jump
+N_ENVS = 8                  # games stepped together by train_vectorized
 
 # STATE
 # ------
@@ -16,15 +25,39 @@ LR = 0.001                  # learning rate
 # Gap Width
 # Pipe X
 
+def epsilon_schedule(n_games, max_epsilon=MAX_EPSILON):
+    '''
+    Chance of a random move for each env, given games played & max epsilon per env
+    Same odds as randint(0, 200) < max_epsilon - n_games, works on arrays
+    '''
+    epsilon = np.asarray(max_epsilon, dtype=float) - np.asarray(n_games, dtype=float)
+    return np.clip(epsilon / 201, 0, 1)
+
+
 class Agent:
     
-    def __init__(self) -> None:
+    def __init__(self, n_step=N_STEP, target_update=TARGET_UPDATE, tau=TAU,
+                 long_train_steps=LONG_TRAIN_STEPS, verbose=True) -> None:
+        # deque(maxlen=0) never fills, so nothing would ever reach memory
+        if n_step < 1:
+            raise ValueError(f'n_step must be at least 1, got {n_step}')
+
         self.n_games = 0
         self.epsilon = 0                            # control randomness
         self.gamma = 0.9                            # discount rate
         self.memory = deque(maxlen=MAX_MEMORY)      # automatically removes oldest (left) elems
+        self.n_step = n_step
+        self.n_step_buffers = {}                    # env id -> last n moves not yet folded into memory
+        self.long_train_steps = long_train_steps
+        self.rng = np.random.default_rng()
+        self.verbose = verbose                      # print whether each move was random or predicted
         self.model = Linear_QNet(5, 100, 2)
-        self.trainer = QTrainer(self.model, LR, self.gamma)
+
+        # only build a target network if some sync rule is given
+        target_model = None
+        if target_update or tau is not None:
+            target_model = Linear_QNet(5, 100, 2)
+        self.trainer = QTrainer(self.model, LR, self.gamma, target_model, target_update, tau)
 
     
     def get_state(self, game: GameAI):
@@ -66,23 +99,56 @@ class Agent:
         return np.array(state, dtype=float)
 
 
-    def remember(self, state, action, reward, next_state, game_over):
+    def remember(self, state, action, reward, next_state, game_over, env_id=0):
         '''
         Adds the current state's info to memory, popleft if over MAX_MEMORY
+        With n_step > 1, memory stores (s_t, a_t, r_t + ... + y^(n-1) r_t+n-1, s_t+n, done)
+        env_id keeps n-step windows of games played side by side apart
         '''
-        self.memory.append((state, action, reward, next_state, game_over))
+        n_step_buffer = self.n_step_buffers.setdefault(env_id, deque(maxlen=self.n_step))
+        n_step_buffer.append((state, action, reward, next_state, game_over))
+
+        # window is full, fold the oldest move into an n-step transition
+        if len(n_step_buffer) == self.n_step:
+            self.memory.append(self._n_step_transition(n_step_buffer))
+
+        # game ended, flush the remaining shorter windows (no bootstrap past game over)
+        if game_over:
+            if len(n_step_buffer) == self.n_step:
+                n_step_buffer.popleft()                 # oldest is already in memory
+            while n_step_buffer:
+                self.memory.append(self._n_step_transition(n_step_buffer))
+                n_step_buffer.popleft()
+
+    def _n_step_transition(self, n_step_buffer):
+        '''
+        Discounted return over the n-step buffer, starting from its oldest move
+        '''
+        state, action = n_step_buffer[0][:2]
+        n_step_return = 0
+        for i, (_, _, reward, next_state, game_over) in enumerate(n_step_buffer):
+            n_step_return += (self.gamma ** i) * reward
+            if game_over:
+                break
+        return (state, action, n_step_return, next_state, game_over)
 
     def train_long_memory(self):
         '''
         Take random sample of 1000 from memory if exists, otherwise the entire memory 
+        Repeated long_train_steps times, fresh sample each step
         '''
-        if len(self.memory) > BATCH_SIZE:
-            random_sample = random.sample(self.memory, BATCH_SIZE)
-        else:
-            random_sample = self.memory
+        if not self.memory:
+            return
+        for _ in range(self.long_train_steps):
+            if len(self.memory) > BATCH_SIZE:
+                random_sample = random.sample(self.memory, BATCH_SIZE)
+            else:
+                random_sample = self.memory
 
-        states, actions, rewards, next_states, game_overs = zip(*random_sample)
-        self.trainer.train_step(states, actions, rewards, next_states, game_overs)
+            states, actions, rewards, next_states, game_overs = zip(*random_sample)
+            self.trainer.train_step(states, actions, rewards, next_states, game_overs,
+                                    discount=self.gamma ** self.n_step)
+            self.trainer.update_target()
 
 
     def train_short_memory(self, state, action, reward, next_state, game_over):
@@ -91,78 +157,223 @@ class Agent:
         '''
         self.trainer.train_step(state, action, reward, next_state, game_over)
 
-    def get_action(self, state):
+    def get_action(self, state, model=None):
         '''
         Do random modes first, then predicted (exploration / exploitation)
+        model defaults to self.model, the async learner passes in its snapshot
         '''
-        self.epsilon = 180 - self.n_games
+        model = self.model if model is None else model
+        self.epsilon = epsilon_schedule(self.n_games)
         final_move = [0, 0]
 
         # random move (more likely earlier on)
-        if random.randint(0, 200) < self.epsilon:
-            final_move = random.choices([[1, 0], [0, 1]], weights=[0.05, 0.95])[0]
-            print("   RANDOM MOVE")
+        if random.random() < self.epsilon:
+            final_move = [1, 0] if random.random() < RANDOM_JUMP_PROB else [0, 1]
+            if self.verbose:
+                print("   RANDOM MOVE")
 
         # predicted move (more likely later on)
         else:
             state0 = torch.tensor(state, dtype=torch.float)
-            prediction = self.model(state0)
+            prediction = model(state0)
             move = torch.argmax(prediction).item()
             final_move[move] = 1
-            print(">> MODEL MOVE")
+            if self.verbose:
+                print(">> MODEL MOVE")
 
         # this will be a 1-element list of what move to
         return final_move
 
+    def get_actions(self, states, epsilons, model=None):
+        '''
+        Moves for a batch of envs in 1 forward pass, states is (N, 5)
+        epsilons is each env's chance of a random move (see epsilon_schedule)
+        Returns (N,) array of move indices, 0 = jump, 1 = don't jump
+        '''
+        model = self.model if model is None else model
+        states = torch.as_tensor(np.asarray(states), dtype=torch.float)
+        with torch.no_grad():
+            predicted_moves = torch.argmax(model(states), dim=1).numpy()
+
+        # random moves for whichever envs are exploring this step
+        n_envs = len(predicted_moves)
+        explore = self.rng.random(n_envs) < epsilons
+        random_moves = (self.rng.random(n_envs) >= RANDOM_JUMP_PROB).astype(predicted_moves.dtype)
+        return np.where(explore, random_moves, predicted_moves)
+
+
+
+def play_move(agent, game, policy=None, train_short=True):
+    '''
+    Play 1 move of game & remember it, training ST memory on it if train_short
+    policy is a context manager giving the model to pick the move with (e.g. AsyncLearner.policy),
+    agent.model if not given
+    Returns (reward, game_over, score) of the move
+    '''
+    # get prev state, predict move & get results of the move
+    state_old = agent.get_state(game)
+    with using_model(agent, policy) as model:
+        final_move = agent.get_action(state_old, model)
+    reward, game_over, score = game.play_step(final_move)
+    state_new = agent.get_state(game)
+
+    # train ST memory
+    if train_short:
+        agent.train_short_memory(state_old, final_move, reward, state_new, game_over)
+    agent.remember(state_old, final_move, reward, state_new, game_over)
+    return reward, game_over, score
+
+
+def end_game(agent, game, train_long=True):
+    '''
+    Reset game after game over & count it, training LT memory if train_long
+    '''
+    game.reset()
+    agent.n_games += 1
+    if train_long:
+        agent.train_long_memory()
+
+
+def using_model(agent, policy=None):
+    '''
+    Context manager giving policy's model if there is one, otherwise agent.model
+    '''
+    return policy() if policy is not None else nullcontext(agent.model)
+
+
+class Progress:
+    '''
+    Scores & record of a training run, saves the model every 20 games & plots the scores
+    '''
+
+    def __init__(self) -> None:
+        self.scores = []
+        self.mean_scores = []
+        self.total_score = 0
+        self.record = 0
+
+    def add(self, agent, score, policy=None, extra=''):
+        '''
+        Track the game that just ended, extra is added to the end of its printed line
+        '''
+        # new record
+        if score > self.record:
+            self.record = score
+
+        # save model every 20 epochs
+        if agent.n_games % 20 == 0:
+            with using_model(agent, policy) as model:
+                model.save()
+            print("===== MODEL SAVED =====")
+
+        print(f'Game {agent.n_games} - Score: {score}, Record: {self.record}{extra}')
+
+        self.scores.append(score)
+        self.total_score += score
+        self.mean_scores.append(self.total_score / agent.n_games)
+
+    def plot(self):
+        '''
+        Redraw the graph of scores & mean scores
+        '''
+        plot(self.scores, self.mean_scores)
 
 
-def train():
+
+def train(profile_every=None):
     '''
     Start training agent
+    profile_every samples memory use every n games into the metrics log (see instrumentation.py)
     '''
-    # variables for plotting & tracking progress
-    plot_scores = []
-    plot_mean_scores = []
-    total_score = 0
-    record = 0
+    # start tracing before anything is allocated
+    monitor = None
+    if profile_every:
+        from instrumentation import MemoryMonitor
+        monitor = MemoryMonitor(profile_every)
 
+    progress = Progress()
     agent = Agent()
     game = GameAI()
     while True:
-
-        # get prev state, predict move & get results of the move
-        state_old = agent.get_state(game)
-        final_move = agent.get_action(state_old)
-        reward, game_over, score = game.play_step(final_move)
-        state_new = agent.get_state(game)
-
-        # train ST memory
-        agent.train_short_memory(state_old, final_move, reward, state_new, game_over)
-        agent.remember(state_old, final_move, reward, state_new, game_over)
+        reward, game_over, score = play_move(agent, game)
 
         if game_over:
-            
+
             # train LT memory, reset, and plot
-            game.reset()
-            agent.n_games += 1
-            agent.train_long_memory()
-
-            # new record
-            if score > record:
-                record = score
-            
-            # save model every 20 epochs (after first 50)
-            if agent.n_games % 20 == 0:
-                agent.model.save()
-                print("===== MODEL SAVED =====")
-            
-            print(f'Game {agent.n_games} - Score: {score}, Record: {record}')
-            
-            plot_scores.append(score)
-            total_score += score
-            plot_mean_scores.append(total_score / agent.n_games)
-            plot(plot_scores, plot_mean_scores)
-            
+            end_game(agent, game)
+            progress.add(agent, score)
+            progress.plot()
+
+            if monitor is not None:
+                monitor.maybe_sample(agent, plot_points=len(progress.scores) + len(progress.mean_scores),
+                                     plot_figures=figure_count())
+
+
+
+def train_vectorized(n_envs=N_ENVS, max_epsilons=None):
+    '''
+    Start training agent on n_envs games stepped together
+    Exploration decays on agent.n_games (games finished across all envs), so the shared model
+    sees the same ~MAX_EPSILON mostly random games as train() rather than n_envs times as many.
+    max_epsilons shifts each env's schedule, defaults to MAX_EPSILON for all
+    '''
+    progress = Progress()
+    agent = Agent()
+    max_epsilons = np.full(n_envs, MAX_EPSILON) if max_epsilons is None else np.asarray(max_epsilons)
+
+    # only the first game waits on the frame cap, otherwise each step would wait n_envs frames
+    games = [GameAI() if i == 0 else GameAI(framerate=0) for i in range(n_envs)]
+    one_hot = np.eye(2, dtype=int)
+    while True:
+
+        # get prev states, predict all moves at once & get results of the moves
+        states_old = np.stack([agent.get_state(game) for game in games])
+        final_moves = one_hot[agent.get_actions(states_old, epsilon_schedule(agent.n_games, max_epsilons))]
+        results = [game.play_step(move.tolist()) for game, move in zip(games, final_moves)]
+        rewards, game_overs, scores = zip(*results)
+        states_new = np.stack([agent.get_state(game) for game in games])
+
+        # train ST memory on the whole batch of moves
+        agent.train_short_memory(states_old, final_moves, rewards, states_new, game_overs)
+        for i in range(n_envs):
+            agent.remember(states_old[i], final_moves[i], rewards[i], states_new[i], game_overs[i], env_id=i)
+
+        for i, game in enumerate(games):
+            if game_overs[i]:
+                end_game(agent, game)
+                progress.add(agent, scores[i], extra=f', Env: {i}')
+
+        if any(game_overs):
+            progress.plot()
+
+
+
+def train_async(num_threads=LEARNER_THREADS):
+    '''
+    Start training agent, with gradient updates on a learner thread using num_threads torch threads
+    The game loop only plays & fills memory, moves come from the learner's latest snapshot
+    '''
+    progress = Progress()
+    agent = Agent()
+    game = GameAI()
+    torch.set_num_threads(ACTOR_THREADS)
+    learner = AsyncLearner(agent, BATCH_SIZE, num_threads)
+    learner.start()
+
+    # set_num_threads isn't strictly per thread, so show what each side actually got
+    print(f'torch threads - game loop: {torch.get_num_threads()}, learner: {learner.learner_threads}')
+    try:
+        while True:
+
+            # learner thread trains on memory, so no ST or LT memory training here
+            reward, game_over, score = play_move(agent, game, learner.policy, train_short=False)
+
+            if game_over:
+                end_game(agent, game, train_long=False)
+                progress.add(agent, score, learner.policy, extra=f', Updates: {learner.updates}')
+                progress.plot()
+    finally:
+        learner.stop()
 
 
 if __name__ == '__main__':
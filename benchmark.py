@@ -0,0 +1,221 @@
+import os
+import random
+import statistics
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# no window needed for benchmarking, must be set before pygame is imported
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import numpy as np
+import torch
+
+from agent import Agent, GameAI, BATCH_SIZE, play_move, end_game
+from learner import AsyncLearner, LEARNER_THREADS, ACTOR_THREADS
+
+TARGET_MEAN_SCORE = 3       # stop once the rolling mean score reaches this
+MEAN_WINDOW = 20            # games in the rolling mean
+MAX_GAMES = 1000            # give up after this many games
+SEEDS = range(5)            # each config is trained once per seed, results are summarised across seeds
+FRAMERATE = 0               # uncapped, otherwise wall-clock is just the frame cap
+WORKLOAD_FRAMES = 20_000    # frames played by each learner mode in the fixed workload comparison
+WORKLOAD_UPDATES = 500      # LT memory batch updates done by each learner mode in the same comparison
+TRAIN_FRAMES = 20_000       # frames played by agent.train's & agent.train_async's loops when compared
+
+# CONFIGS
+# --------
+# name -> Agent kwargs, compared against each other on the same target
+CONFIGS = {
+    'baseline': dict(),
+    'target_net': dict(target_update=20, long_train_steps=4),     # sync every 5 games
+    'polyak_3_step': dict(tau=0.005, n_step=3, long_train_steps=4),
+}
+
+
+def seed_everything(seed):
+    '''
+    Seed python, numpy & torch so pipes, exploration & initial weights repeat
+    '''
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def time_to_score(target_mean=TARGET_MEAN_SCORE, window=MEAN_WINDOW, max_games=MAX_GAMES, seed=None, **agent_kwargs):
+    '''
+    Train a fresh agent until the mean of the last `window` scores reaches target_mean
+    Returns dict of games played, wall-clock seconds, frames played and whether it got there
+    '''
+    if seed is not None:
+        seed_everything(seed)
+    agent = Agent(verbose=False, **agent_kwargs)
+    game = GameAI(framerate=FRAMERATE)
+    recent_scores = deque(maxlen=window)
+    frames = 0
+    start = time.perf_counter()
+
+    while agent.n_games < max_games:
+
+        # same moves & training as agent.train, without saving, plotting or profiling
+        reward, game_over, score = play_move(agent, game)
+        frames += 1
+
+        if game_over:
+            end_game(agent, game)
+            recent_scores.append(score)
+
+            if len(recent_scores) == window and sum(recent_scores) / window >= target_mean:
+                break
+
+    reached = len(recent_scores) == window and sum(recent_scores) / window >= target_mean
+    return {
+        'games': agent.n_games,
+        'seconds': time.perf_counter() - start,
+        'frames': frames,
+        'reached': reached,
+    }
+
+
+def time_to_score_seeds(seeds=SEEDS, **agent_kwargs):
+    '''
+    Run time_to_score once per seed, single runs are mostly exploration noise
+    Returns dict of median & min/max games and seconds, plus how many seeds reached the target
+    '''
+    runs = [time_to_score(seed=seed, **agent_kwargs) for seed in seeds]
+    summary = {'runs': len(runs), 'reached': sum(run['reached'] for run in runs)}
+    for key in ('games', 'seconds'):
+        values = [run[key] for run in runs]
+        summary[key] = (statistics.median(values), min(values), max(values))
+    return summary
+
+
+@contextmanager
+def torch_threads(num_threads):
+    '''
+    Set torch's thread count for the with block, then put back whatever it was before
+    '''
+    saved_threads = torch.get_num_threads()
+    torch.set_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(saved_threads)
+
+
+def fixed_workload(async_learner, frames=WORKLOAD_FRAMES, updates=WORKLOAD_UPDATES, num_threads=LEARNER_THREADS):
+    '''
+    Wall-clock time to play `frames` frames & do `updates` LT memory batch updates, either alternating
+    between the 2 (like agent.train) or overlapping them on a learner thread (like agent.train_async)
+    Neither mode trains ST memory, so both do exactly the same work
+    Returns dict of seconds & the torch thread counts each side actually ran with
+    '''
+    agent = Agent(verbose=False)
+    game = GameAI(framerate=FRAMERATE)
+    learner = None
+    learner_running = False
+    with torch_threads(ACTOR_THREADS if async_learner else num_threads):
+        start = time.perf_counter()
+        if async_learner:
+            learner = AsyncLearner(agent, BATCH_SIZE, num_threads)
+            learner.start()
+            learner_running = True
+        try:
+            for frame in range(1, frames + 1):
+                policy = None if learner is None else learner.policy
+                reward, game_over, score = play_move(agent, game, policy, train_short=False)
+
+                # learner has done its share, stop it so it doesn't take cpu from the game loop
+                if learner_running and agent.trainer.steps >= updates:
+                    learner_running = False
+                    learner.stop()
+
+                if game_over:
+                    end_game(agent, game, train_long=False)
+
+                    # alternating does its updates at the end of each game, keeping pace with frames played
+                    if learner is None and len(agent.memory) > BATCH_SIZE:
+                        while agent.trainer.steps < updates * frame // frames:
+                            agent.train_long_memory()
+
+            # finish off whichever updates are left
+            if learner is None:
+                while agent.trainer.steps < updates:
+                    agent.train_long_memory()
+            while learner_running and agent.trainer.steps < updates:
+                learner.check()
+                time.sleep(0.001)
+            seconds = time.perf_counter() - start
+        finally:
+            if learner_running:
+                learner.stop()
+
+        return {
+            'seconds': seconds,
+            'game_loop_threads': torch.get_num_threads(),
+            'learner_threads': None if learner is None else learner.learner_threads,
+        }
+
+
+def train_modes(async_learner, frames=TRAIN_FRAMES, num_threads=LEARNER_THREADS):
+    '''
+    Play `frames` frames with agent.train's training (ST memory every move, LT memory every game)
+    or agent.train_async's (free running learner thread), the swap a user would actually make
+    Returns dict of seconds, LT memory batch updates, ST memory steps & thread counts
+    '''
+    agent = Agent(verbose=False)
+    game = GameAI(framerate=FRAMERATE)
+    learner = None
+    with torch_threads(ACTOR_THREADS if async_learner else num_threads):
+        start = time.perf_counter()
+        if async_learner:
+            learner = AsyncLearner(agent, BATCH_SIZE, num_threads)
+            learner.start()
+        try:
+            policy = None if learner is None else learner.policy
+            for _ in range(frames):
+                reward, game_over, score = play_move(agent, game, policy, train_short=learner is None)
+                if game_over:
+                    end_game(agent, game, train_long=learner is None)
+        finally:
+            if learner is not None:
+                learner.stop()
+        seconds = time.perf_counter() - start
+
+        return {
+            'seconds': seconds,
+            'batch_updates': agent.trainer.steps,
+            'short_steps': frames if learner is None else 0,
+            'game_loop_threads': torch.get_num_threads(),
+            'learner_threads': None if learner is None else learner.learner_threads,
+        }
+
+
+if __name__ == '__main__':
+    results = {name: time_to_score_seeds(**kwargs) for name, kwargs in CONFIGS.items()}
+
+    print(f'\nTime to mean score {TARGET_MEAN_SCORE} over last {MEAN_WINDOW} games, '
+          f'median [min - max] over {len(SEEDS)} seeds')
+    for name, result in results.items():
+        games, seconds = result['games'], result['seconds']
+        print(f"{name:>15}: {games[0]:>6.0f} games [{games[1]} - {games[2]}], "
+              f"{seconds[0]:>7.1f}s [{seconds[1]:.1f} - {seconds[2]:.1f}], "
+              f"reached in {result['reached']}/{result['runs']}")
+
+    alternating = fixed_workload(async_learner=False)
+    overlapped = fixed_workload(async_learner=True)
+
+    print(f'\nFixed workload: {WORKLOAD_FRAMES} frames + {WORKLOAD_UPDATES} batch updates')
+    for name, result in (('alternating', alternating), ('overlapped', overlapped)):
+        print(f"{name:>15}: {result['seconds']:>8.1f}s (torch threads - game loop: "
+              f"{result['game_loop_threads']}, learner: {result['learner_threads']})")
+    print(f"{'speedup':>15}: {alternating['seconds'] / overlapped['seconds']:>8.2f}x wall-clock")
+
+    train_result = train_modes(async_learner=False)
+    train_async_result = train_modes(async_learner=True)
+
+    print(f'\nagent.train vs agent.train_async over {TRAIN_FRAMES} frames')
+    for name, result in (('train', train_result), ('train_async', train_async_result)):
+        print(f"{name:>15}: {result['seconds']:>8.1f}s, {TRAIN_FRAMES / result['seconds']:>8.1f} frames/s, "
+              f"{result['batch_updates']:>6} batch updates, {result['short_steps']:>6} ST memory steps")
+    print(f"{'speedup':>15}: {train_result['seconds'] / train_async_result['seconds']:>8.2f}x wall-clock")
@@ -0,0 +1,77 @@
+import os
+
+# no window needed, must be set before pygame is imported
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+from agent import Agent
+
+
+def play_fake_game(agent, rewards, env_id=0):
+    '''
+    Remember 1 game with the given rewards, states are just the move number
+    '''
+    for i, reward in enumerate(rewards):
+        game_over = i == len(rewards) - 1
+        agent.remember(i, [0, 1], reward, i + 1, game_over, env_id=env_id)
+
+
+def check_full_window():
+    '''
+    5 move game with n = 3, every move gets folded with up to 2 moves after it
+    '''
+    agent = Agent(n_step=3, verbose=False)
+    play_fake_game(agent, [1, 2, 3, 4, 5])
+
+    states = [transition[0] for transition in agent.memory]
+    returns = [round(transition[2], 2) for transition in agent.memory]
+    next_states = [transition[3] for transition in agent.memory]
+    game_overs = [transition[4] for transition in agent.memory]
+    assert states == [0, 1, 2, 3, 4], states
+    assert returns == [5.23, 7.94, 10.65, 8.5, 5.0], returns
+    assert next_states == [3, 4, 5, 5, 5], next_states
+    assert game_overs == [False, False, True, True, True], game_overs
+    assert not agent.n_step_buffers[0]
+
+
+def check_short_game():
+    '''
+    2 move game with n = 3 never fills the window, both moves come out of the flush
+    '''
+    agent = Agent(n_step=3, verbose=False)
+    play_fake_game(agent, [1, 2])
+
+    assert [transition[0] for transition in agent.memory] == [0, 1]
+    assert [round(transition[2], 2) for transition in agent.memory] == [2.8, 2.0]
+    assert all(transition[3] == 2 and transition[4] for transition in agent.memory)
+    assert not agent.n_step_buffers[0]
+
+
+def check_one_step():
+    '''
+    n = 1 stores every move as it is, like remember did before n-step returns
+    '''
+    agent = Agent(n_step=1, verbose=False)
+    rewards = [0, 10, 0, -10]
+    play_fake_game(agent, rewards)
+
+    expected = [(i, [0, 1], reward, i + 1, i == len(rewards) - 1) for i, reward in enumerate(rewards)]
+    assert list(agent.memory) == expected, list(agent.memory)
+
+
+def check_rejects_zero_step():
+    '''
+    n_step = 0 would never store anything
+    '''
+    try:
+        Agent(n_step=0, verbose=False)
+    except ValueError:
+        return
+    raise AssertionError('Agent accepted n_step=0')
+
+
+if __name__ == '__main__':
+    check_full_window()
+    check_short_game()
+    check_one_step()
+    check_rejects_zero_step()
+    print('n-step checks passed')
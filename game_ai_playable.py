@@ -111,12 +111,14 @@ class Player:
 
 class GameAI:
 
-    def __init__(self) -> None:
+    def __init__(self, framerate: int = FRAMERATE) -> None:
         '''
         Initialize game variables
+        framerate caps the game speed, 0 runs frames as fast as possible
         '''
 
         # initialize PyGame variables
+        self.framerate = framerate
         self.clock = pygame.time.Clock()
         self.surface = pygame.display.set_mode((VW, VH), vsync=1)
         pygame.display.set_caption('Walmart Flappy Bird')
@@ -143,7 +145,7 @@ class GameAI:
         '''
         play 1 frame of the game
         '''
-        self.clock.tick(FRAMERATE)
+        self.clock.tick(self.framerate)
         self.time_till_pipe -= 1
         game_over = False
         reward = 0
@@ -3,6 +3,12 @@ from IPython import display
 
 plt.ion()
 
+def figure_count():
+    '''
+    Number of matplotlib figures currently open
+    '''
+    return len(plt.get_fignums())
+
 def plot(scores, mean_scores):
     display.clear_output(wait=True)
     display.display(plt.gcf())
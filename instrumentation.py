@@ -0,0 +1,166 @@
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import torch
+
+PROFILE_EVERY = 50                          # games between memory samples
+METRICS_LOG = './logs/metrics.jsonl'        # 1 json object per sample
+TOP_ALLOCATIONS = 10                        # tracemalloc sites recorded per sample
+GROWTH_WINDOW = 10                          # samples looked at when checking for growth
+GROWTH_STEADY_FRACTION = 0.8                # share of samples that must grow to call it steady
+GROWTH_MIN_BYTES = 10 * 1024 * 1024         # ignore growth smaller than this over the window
+                                            # growth only counts once replay memory is full
+
+
+def rss_bytes():
+    '''
+    Current resident memory of this process, None where /proc isn't available (e.g. macOS, Windows)
+    '''
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def peak_rss_bytes():
+    '''
+    Highest resident memory this process has reached, None on platforms without resource (e.g. Windows)
+    Only ever goes up, so it's logged separately & not used for the growth check
+    '''
+    # resource is POSIX only, so only import it when it's actually needed
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def replay_bytes(memory):
+    '''
+    Estimated size of replay memory, from its first transition times its length
+    Every transition has the same shape, so this avoids walking 100,000 entries
+    '''
+    if not memory:
+        return sys.getsizeof(memory)
+    transition = memory[0]
+    per_transition = sys.getsizeof(transition) + sum(sys.getsizeof(field) for field in transition)
+    return sys.getsizeof(memory) + per_transition * len(memory)
+
+
+def tensor_bytes(agent):
+    '''
+    Bytes held by the model & trainer tensors, plus the CUDA allocator's own stats if in use
+    '''
+    tensors = list(agent.model.parameters())
+    tensors += [param.grad for param in agent.model.parameters() if param.grad is not None]
+    if agent.trainer.target_model is not None:
+        tensors += list(agent.trainer.target_model.parameters())
+    for state in agent.trainer.optimizer.state.values():
+        tensors += [value for value in state.values() if torch.is_tensor(value)]
+
+    stats = {'model_tensor_bytes': sum(t.element_size() * t.nelement() for t in tensors)}
+    if torch.cuda.is_available():
+        stats['cuda_allocated_bytes'] = torch.cuda.memory_allocated()
+        stats['cuda_reserved_bytes'] = torch.cuda.memory_reserved()
+    return stats
+
+
+class MemoryMonitor:
+    '''
+    Samples process memory every few games during training & appends it to the metrics log
+    Flags when RSS keeps going up across the last GROWTH_WINDOW samples, once replay memory
+    is full (it grows legitimately until it reaches maxlen)
+    '''
+
+    def __init__(self, every=PROFILE_EVERY, log_path=METRICS_LOG, top=TOP_ALLOCATIONS,
+                 window=GROWTH_WINDOW) -> None:
+        self.every = every
+        self.log_path = log_path
+        self.top = top
+        self.window = window
+        self.rss_history = []
+        self.last_snapshot = None
+
+        log_folder_path = os.path.dirname(self.log_path)
+        if log_folder_path and not os.path.exists(log_folder_path):
+            os.makedirs(log_folder_path)
+
+        # tracemalloc only sees allocations made after it starts, so start as early as possible
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def maybe_sample(self, agent, **extra):
+        '''
+        Sample if agent.n_games is a multiple of every, returns the sample or None
+        '''
+        if agent.n_games % self.every != 0:
+            return None
+        return self.sample(agent, **extra)
+
+    def sample(self, agent, **extra):
+        '''
+        Record RSS, replay size, tensor stats & top allocation sites, then check for growth
+        extra fields (e.g. length of the plot lists) are logged as they are
+        '''
+        snapshot = tracemalloc.take_snapshot()
+        traced_current, traced_peak = tracemalloc.get_traced_memory()
+        metrics = {
+            'time': time.time(),
+            'n_games': agent.n_games,
+            'rss_bytes': rss_bytes(),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'replay_transitions': len(agent.memory),
+            'replay_bytes': replay_bytes(agent.memory),
+            'traced_bytes': traced_current,
+            'traced_peak_bytes': traced_peak,
+            **tensor_bytes(agent),
+            'top_allocations': self._top_allocations(snapshot.statistics('lineno')),
+            **extra,
+        }
+
+        # what grew since the last sample is more telling than what's big
+        if self.last_snapshot is not None:
+            metrics['top_growth'] = self._top_allocations(snapshot.compare_to(self.last_snapshot, 'lineno'))
+        self.last_snapshot = snapshot
+
+        # only track RSS once replay memory is full, before that it's expected to grow
+        metrics['replay_full'] = len(agent.memory) == agent.memory.maxlen
+        if metrics['replay_full'] and metrics['rss_bytes'] is not None:
+            self.rss_history.append(metrics['rss_bytes'])
+            self.rss_history = self.rss_history[-self.window:]
+        metrics['rss_growing'] = self.steady_growth()
+        if metrics['rss_growing']:
+            print(f"!!!!! RSS grew in most of the last {self.window} samples with replay memory full, "
+                  f"now {metrics['rss_bytes'] / 2 ** 20:.1f} MB !!!!!")
+
+        with open(self.log_path, 'a') as log:
+            log.write(json.dumps(metrics) + '\n')
+        return metrics
+
+    def steady_growth(self):
+        '''
+        Whether RSS went up in most of the last window samples, by more than GROWTH_MIN_BYTES overall
+        '''
+        if len(self.rss_history) < self.window:
+            return False
+        increases = sum(later > earlier for earlier, later in zip(self.rss_history, self.rss_history[1:]))
+        total_growth = self.rss_history[-1] - self.rss_history[0]
+        return increases >= GROWTH_STEADY_FRACTION * (self.window - 1) and total_growth > GROWTH_MIN_BYTES
+
+    def _top_allocations(self, statistics):
+        '''
+        Top allocation sites as json friendly dicts
+        '''
+        top = []
+        for stat in statistics[:self.top]:
+            frame = stat.traceback[0]
+            site = {'site': f'{frame.filename}:{frame.lineno}', 'bytes': stat.size, 'count': stat.count}
+            if hasattr(stat, 'size_diff'):
+                site['bytes_diff'] = stat.size_diff
+            top.append(site)
+        return top
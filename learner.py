@@ -0,0 +1,122 @@
+import copy
+import threading
+import time
+from contextlib import contextmanager
+
+import torch
+
+LEARNER_THREADS = 2         # torch intra-op threads asked for by the learner, 100 hidden units doesn't need more
+ACTOR_THREADS = 1           # torch intra-op threads asked for by the game loop's forward passes
+PUBLISH_EVERY = 10          # gradient steps between handing new weights to the game loop
+
+
+class AsyncLearner:
+    '''
+    Runs agent.train_long_memory on its own thread while the game loop keeps playing
+
+    The learner owns agent.model & agent.trainer. The game loop picks moves from one of
+    2 snapshots of the model: the learner copies fresh weights into the back snapshot,
+    then swaps it to the front, so the game loop never sees half-copied weights.
+
+    torch.set_num_threads also changes process-wide settings, so the game loop's & learner's
+    counts can override each other. learner_threads records what the learner actually got.
+    '''
+
+    def __init__(self, agent, batch_size, num_threads=LEARNER_THREADS, publish_every=PUBLISH_EVERY) -> None:
+        self.agent = agent
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.publish_every = publish_every
+
+        # double buffered copies of the model for the game loop
+        self.snapshots = [copy.deepcopy(agent.model).requires_grad_(False) for _ in range(2)]
+        self.front = 0
+        self.lock = threading.Lock()
+
+        self.updates = 0
+        self.publishes = 0
+        self._error = None                      # exception that killed the learner thread, if any
+        self.learner_threads = None             # torch.get_num_threads() seen on the learner thread
+        self._ready = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='learner', daemon=True)
+
+    def start(self) -> None:
+        '''
+        Start learning in the background, returns once the learner has set its thread count
+        '''
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self) -> None:
+        '''
+        Finish the current update and wait for the learner thread to exit
+        '''
+        self._stop_event.set()
+        self._thread.join()
+        self.check()
+
+    def check(self) -> None:
+        '''
+        Re-raise on the calling thread if the learner thread died
+        '''
+        if self._error is not None:
+            raise RuntimeError('learner thread stopped with an error') from self._error
+
+    @contextmanager
+    def policy(self):
+        '''
+        Front snapshot to pick moves with, held until the with block exits
+        Raises if the learner thread died, rather than playing on stale weights forever
+        '''
+        self.check()
+        with self.lock:
+            yield self.snapshots[self.front]
+
+    def publish(self) -> None:
+        '''
+        Copy current weights into the back snapshot, then make it the front one
+        '''
+        back = self.snapshots[1 - self.front]
+        with torch.no_grad():
+            for snapshot_param, param in zip(back.parameters(), self.agent.model.parameters()):
+                snapshot_param.copy_(param)
+
+        # nobody holds the old front once the lock is ours, so it's safe to overwrite next time
+        with self.lock:
+            self.front = 1 - self.front
+        self.publishes += 1
+
+    def _run(self) -> None:
+        '''
+        Learner thread loop, keeps any error for the game loop to raise
+        '''
+        try:
+            self._learn()
+        except Exception as error:
+            self._error = error
+        finally:
+            self._ready.set()
+
+    def _learn(self) -> None:
+        '''
+        Train on memory whenever there's enough of it, until stopped
+        '''
+        # set from the learner thread, then record what this thread really ended up with
+        torch.set_num_threads(self.num_threads)
+        self.learner_threads = torch.get_num_threads()
+        self._ready.set()
+        last_publish = 0
+        while not self._stop_event.is_set():
+
+            # wait for more than a batch, so memory is only ever sampled (not iterated while growing)
+            if len(self.agent.memory) <= self.batch_size:
+                time.sleep(0.01)
+                continue
+
+            self.agent.train_long_memory()
+            self.updates += self.agent.long_train_steps
+
+            if self.updates - last_publish >= self.publish_every:
+                self.publish()
+                last_publish = self.updates
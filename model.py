@@ -2,6 +2,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
+import numpy as np
 import os
 
 # INPUT SIZE: 5
@@ -37,18 +38,48 @@ class Linear_QNet(nn.Module):
 
 
 class QTrainer:
-    def __init__(self, model, lr, gamma):
+    def __init__(self, model, lr, gamma, target_model=None, target_update=0, tau=None):
         self.model = model
         self.lr = lr
         self.gamma = gamma
         self.optimizer = optim.Adam(model.parameters(), lr=self.lr)
         self.criterion = nn.MSELoss()
 
-    def train_step(self, state, action, reward, next_state, game_over):
-        state = torch.tensor(state, dtype=torch.float)
-        next_state = torch.tensor(next_state, dtype=torch.float)
-        action = torch.tensor(action, dtype=torch.long)
-        reward = torch.tensor(reward, dtype=torch.float)
+        # optional frozen copy of the model to bootstrap Q targets from
+        # synced every target_update batch steps, or softly every batch step if tau is set
+        # steps only counts batch (long memory) updates, see update_target
+        self.target_model = target_model
+        self.target_update = target_update
+        self.tau = tau
+        self.steps = 0
+        if self.target_model is not None:
+            self.target_model.load_state_dict(self.model.state_dict())
+            self.target_model.requires_grad_(False)
+
+    def sync_target(self):
+        '''
+        Copy online weights into the target network (Polyak average if tau is set)
+        '''
+        if self.target_model is None:
+            return
+        if self.tau is None:
+            self.target_model.load_state_dict(self.model.state_dict())
+            return
+        with torch.no_grad():
+            for target_param, param in zip(self.target_model.parameters(), self.model.parameters()):
+                target_param.mul_(1 - self.tau).add_(param, alpha=self.tau)
+
+    def train_step(self, state, action, reward, next_state, game_over, discount=None):
+        '''
+        1 gradient step on a transition or batch of transitions
+        discount is the bootstrap factor, gamma ** n for n-step returns
+        '''
+        discount = self.gamma if discount is None else discount
+        state = torch.tensor(np.array(state), dtype=torch.float)
+        next_state = torch.tensor(np.array(next_state), dtype=torch.float)
+        action = torch.tensor(np.array(action), dtype=torch.long)
+        reward = torch.tensor(np.array(reward), dtype=torch.float)
+        game_over = torch.tensor(np.array(game_over), dtype=torch.bool)
 
         # prepend 1 dimension to beginning of tensor
         if len(state.shape) == 1:
@@ -56,22 +87,31 @@ class QTrainer:
             next_state = torch.unsqueeze(next_state, 0)
             action = torch.unsqueeze(action, 0)
             reward = torch.unsqueeze(reward, 0)
-            game_over = (game_over, )
+            game_over = torch.unsqueeze(game_over, 0)
         
         # 1. get predicted Q values with current state
         pred = self.model(state)
 
-        target = pred.clone()
-        for idx in range(len(game_over)):
-            Q_new = reward[idx]
-            if not game_over[idx]:
-                Q_new = reward[idx] + self.gamma * torch.max(self.model(next_state[idx]))
-            
-            target[idx][torch.argmax(action[idx]).item()] = Q_new
+        # 2. Q_new = r + y * max(next_predicted_Q), no bootstrap on game over
+        bootstrap_model = self.model if self.target_model is None else self.target_model
+        with torch.no_grad():
+            next_q = bootstrap_model(next_state).max(dim=1).values
+        Q_new = reward + discount * next_q * (~game_over).float()
+
+        target = pred.detach().clone()
+        target[torch.arange(len(target)), torch.argmax(action, dim=1)] = Q_new
 
-        # 2. Q_new = r + y * max(next_predicted_Q)
         self.optimizer.zero_grad()
         loss = self.criterion(target, pred)
         loss.backward()
 
         self.optimizer.step()
+
+    def update_target(self):
+        '''
+        Count 1 batch (long memory) update & sync the target network if it's due
+        Single move updates don't count, so target_update is in batches, not frames
+        '''
+        self.steps += 1
+        if self.tau is not None or (self.target_update and self.steps % self.target_update == 0):
+            self.sync_target()